@@ -1,6 +1,5 @@
-from dataset import SplitImages
+from dataset import SplitImages, read_image
 import os
-import glob
 import torch
 import torchvision
 from tqdm.auto import tqdm
@@ -24,7 +23,11 @@ class Tedd1104Dataset(Dataset):
             ]
         )
 
-        self.dataset_files = glob.glob(os.path.join(dataset_dir, "*.jpeg"))
+        self.dataset_files = [
+            entry.path
+            for entry in os.scandir(dataset_dir)
+            if entry.name.endswith(".jpeg")
+        ]
 
     def __len__(self):
         """
@@ -44,7 +47,7 @@ class Tedd1104Dataset(Dataset):
         if torch.is_tensor(idx):
             idx = int(idx)
 
-        image = torchvision.io.read_image(self.dataset_files[idx])
+        image = read_image(self.dataset_files[idx])
         images, _ = self.transform((image, 0))
         return images
 
@@ -61,38 +64,38 @@ def collate_fn(batch):
 
 
 def calculate_mean_str(dataset_dir: str):
-    dataset_files = list(glob.glob(os.path.join(dataset_dir, "*.jpeg")))
-
-    mean_sum = torch.tensor([0.0, 0.0, 0.0])
-    stds_sum = torch.tensor([0.0, 0.0, 0.0])
-    total = 0
+    channel_sum = torch.zeros(3, dtype=torch.float64)
+    channel_sum_sq = torch.zeros(3, dtype=torch.float64)
+    pixel_count = 0
     dataset = Tedd1104Dataset(dataset_dir=dataset_dir)
     dataloader = DataLoader(
         dataset=dataset,
         batch_size=64,
         collate_fn=collate_fn,
-        num_workers=os.cpu_count() // 2,
+        num_workers=min(os.cpu_count(), 16),
     )
     with tqdm(
         total=len(dataloader),
         desc=f"Reading images",
     ) as pbar:
-        for batch in dataloader:
-            for image in batch:
-                for dim in range(3):
-                    channel = image[dim] / 255.0
-                    mean_sum[dim] += torch.mean(channel)
-                    stds_sum[dim] += torch.std(channel)
-                total += 1
+        for batch_no, batch in enumerate(dataloader):
+            images = batch.to(torch.float64)
+            channel_sum += images.sum(dim=(0, 2, 3))
+            channel_sum_sq += (images * images).sum(dim=(0, 2, 3))
+            pixel_count += images.size(0) * images.size(2) * images.size(3)
             pbar.update(1)
-            pbar.set_description(
-                desc=f"Reading images. "
-                f"Mean: [{round(mean_sum[0].item()/total,6)},{round(mean_sum[1].item()/total,6)},{round(mean_sum[2].item()/total,6)}]. "
-                f"STD: [{round(stds_sum[0].item()/total,6)},{round(stds_sum[1].item()/total,6)},{round(stds_sum[2].item()/total,6)}].",
-            )
-
-    mean = mean_sum / total
-    std = stds_sum / total
+            if batch_no % 256 == 0:
+                mean = channel_sum / pixel_count
+                std = torch.sqrt(channel_sum_sq / pixel_count - mean * mean)
+                pbar.set_postfix(
+                    mean=(mean / 255.0).tolist(),
+                    std=(std / 255.0).tolist(),
+                )
+
+    mean = channel_sum / pixel_count
+    std = torch.sqrt(channel_sum_sq / pixel_count - mean * mean)
+    mean /= 255.0
+    std /= 255.0
 
     print(f"Mean: {mean}")
     print(f"std: {std}")
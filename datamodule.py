@@ -0,0 +1,166 @@
+from dataset import Tedd1104Dataset, collate_fn, set_worker_sharing_strategy
+from torch.utils.data import DataLoader
+from typing import List, Optional
+import os
+import pytorch_lightning as pl
+
+
+class Tedd1104DataModule(pl.LightningDataModule):
+    """
+    Tedd1104DataModule is a PyTorch Lightning DataModule for the Tedd1104 dataset.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        train_dir: str = None,
+        val_dir: str = None,
+        test_dir: str = None,
+        token_mask_prob: float = 0.0,
+        transformer_nheads: int = None,
+        sequence_length: int = 5,
+        hide_map_prob: float = 0.0,
+        dropout_images_prob: List[float] = None,
+        control_mode: str = "keyboard",
+        num_workers: int = os.cpu_count(),
+        num_workers_cap: int = 8,
+        prefetch_factor: int = 4,
+    ):
+        """
+        Initializes the Tedd1104DataModule.
+
+        :param int batch_size: Batch size for the dataset.
+        :param str train_dir: Directory containing the training dataset.
+        :param str val_dir: Directory containing the validation dataset.
+        :param str test_dir: Directory containing the test dataset.
+        :param bool token_mask_prob: Probability of masking a token in the transformer model (0<=token_mask_prob<=1)
+        :param int transformer_nheads: Number of heads in the transformer model, None if LSTM is used
+        :param int sequence_length: Length of the image sequence
+        :param float hide_map_prob: Probability of hiding the minimap (0<=hide_map_prob<=1)
+        :param float dropout_images_prob: Probability of dropping an image (0<=dropout_images_prob<=1)
+        :param str control_mode: Record the input from the "keyboard" or "controller"
+        :param int num_workers: Number of workers to use to load the dataset.
+        :param int num_workers_cap: Upper bound on num_workers, worker scaling flattens out beyond ~8.
+        :param int prefetch_factor: Number of batches each worker loads ahead of time.
+        """
+        super().__init__()
+        self.train_dir = train_dir
+        self.val_dir = val_dir
+        self.test_dir = test_dir
+        self.batch_size = batch_size
+        self.token_mask_prob = token_mask_prob
+        self.transformer_nheads = transformer_nheads
+        self.sequence_length = sequence_length
+        self.hide_map_prob = hide_map_prob
+        self.dropout_images_prob = (
+            dropout_images_prob if dropout_images_prob else [0.0, 0.0, 0.0, 0.0, 0.0]
+        )
+        self.control_mode = control_mode
+
+        if num_workers > 32:
+            print(
+                "WARNING: num_workers is greater than 32, this may cause memory issues, consider using a smaller value."
+                "Go ahead if you have a lot of RAM."
+            )
+
+        self.num_workers = min(num_workers, num_workers_cap)
+        self.prefetch_factor = prefetch_factor
+
+    def setup(self, stage: Optional[str] = None) -> None:
+        """
+        Sets up the dataset.
+
+        :param str stage: Stage of the setup.
+        """
+        if stage in (None, "fit"):
+            self.train_dataset = Tedd1104Dataset(
+                dataset_dir=self.train_dir,
+                hide_map_prob=self.hide_map_prob,
+                dropout_images_prob=self.dropout_images_prob,
+                control_mode=self.control_mode,
+                train=True,
+                token_mask_prob=self.token_mask_prob,
+                transformer_nheads=self.transformer_nheads,
+                sequence_length=self.sequence_length,
+            )
+
+            print(f"Total training samples: {len(self.train_dataset)}.")
+
+            self.val_dataset = Tedd1104Dataset(
+                dataset_dir=self.val_dir,
+                hide_map_prob=0.0,
+                dropout_images_prob=[0.0, 0.0, 0.0, 0.0, 0.0],
+                control_mode="keyboard",
+                token_mask_prob=0.0,
+                transformer_nheads=self.transformer_nheads,
+                sequence_length=self.sequence_length,
+            )
+
+            print(f"Total validation samples: {len(self.val_dataset)}.")
+
+        if stage in (None, "test"):
+            self.test_dataset = Tedd1104Dataset(
+                dataset_dir=self.test_dir,
+                hide_map_prob=0.0,
+                dropout_images_prob=[0.0, 0.0, 0.0, 0.0, 0.0],
+                control_mode="keyboard",
+                token_mask_prob=0.0,
+                transformer_nheads=self.transformer_nheads,
+                sequence_length=self.sequence_length,
+            )
+
+            print(f"Total test samples: {len(self.test_dataset)}.")
+
+    def train_dataloader(self) -> DataLoader:
+        """
+        Returns the training dataloader.
+
+        :return: DataLoader - Training dataloader.
+        """
+        return DataLoader(
+            self.train_dataset,
+            batch_size=self.batch_size,
+            num_workers=self.num_workers,
+            pin_memory=True,
+            shuffle=True,
+            persistent_workers=True,
+            prefetch_factor=self.prefetch_factor,
+            collate_fn=collate_fn,
+            worker_init_fn=set_worker_sharing_strategy,
+        )
+
+    def val_dataloader(self) -> DataLoader:
+        """
+        Returns the validation dataloader.
+
+        :return: DataLoader - Validation dataloader.
+        """
+        return DataLoader(
+            self.val_dataset,
+            batch_size=self.batch_size,
+            num_workers=self.num_workers,
+            pin_memory=True,
+            shuffle=False,
+            persistent_workers=True,
+            prefetch_factor=self.prefetch_factor,
+            collate_fn=collate_fn,
+            worker_init_fn=set_worker_sharing_strategy,
+        )
+
+    def test_dataloader(self) -> DataLoader:
+        """
+        Returns the test dataloader.
+
+        :return: DataLoader - Test dataloader.
+        """
+        return DataLoader(
+            self.test_dataset,
+            batch_size=self.batch_size,
+            num_workers=self.num_workers,
+            pin_memory=True,
+            shuffle=False,
+            persistent_workers=True,
+            prefetch_factor=self.prefetch_factor,
+            collate_fn=collate_fn,
+            worker_init_fn=set_worker_sharing_strategy,
+        )
@@ -1,482 +1,781 @@
-from __future__ import print_function, division
-import os
-import torch
-import torchvision.io
-from torch.utils.data import Dataset, DataLoader
-from torchvision import transforms
-import glob
-from typing import List, Optional, Dict
-from utils import IOHandler, get_mask
-import pytorch_lightning as pl
-
-
-def count_examples(dataset_dir: str) -> int:
-    return len(glob.glob(os.path.join(dataset_dir, "*.jpeg")))
-
-
-class RemoveMinimap(object):
-    """Remove minimap (black square) from all the images in the sequence"""
-
-    def __init__(self, hide_map_prob: float):
-        """
-        INIT
-
-        :param float hide_map_prob: Probability of hiding the minimap (0<=hide_map_prob<=1)
-        """
-
-        self.hide_map_prob = hide_map_prob
-
-    def __call__(self, sample: Dict[str, torch.tensor]) -> (torch.tensor, torch.tensor):
-        """
-        Applies the transformation to the sequence of images.
-
-        :param Dict[str, np.ndarray] sample: Sequence of images
-        :return: Dict[str, np.ndarray]- Transformed sequence of images
-        """
-
-        image, y = sample
-
-        width: int = int(image.size(2) / 5)
-
-        if self.hide_map_prob > 0:
-            if torch.rand(1)[0] <= self.hide_map_prob:
-                for j in range(0, 5):
-                    image[:, 215:, j * width : (j * width) + 80] = torch.zeros(
-                        (3, 55, 80), dtype=image.dtype
-                    )
-
-        return image, y
-
-
-class RemoveImage(object):
-    """
-    Removes random images (black out) from the sequence
-    """
-
-    def __init__(self, dropout_images_prob: List[float]):
-        """
-        INIT
-
-        :param  List[float] dropout_images_prob: Probability of dropping each image (0<=dropout_images_prob<=1)
-        """
-        self.dropout_images_prob = dropout_images_prob
-
-    def __call__(self, sample: Dict[str, torch.tensor]) -> (torch.tensor, torch.tensor):
-        """
-        Applies the transformation to the sequence of images.
-
-        :param Dict[str, np.ndarray] sample: Sequence of images
-        :return: Dict[str, np.ndarray]- Transformed sequence of images
-        """
-        image, y = sample
-
-        width: int = int(image.size(2) / 5)
-
-        for j in range(0, 5):
-            if self.dropout_images_prob[j] > 0:
-                if torch.rand(1)[0] <= self.dropout_images_prob[j]:
-                    image[:, :, j * width : (j + 1) * width] = torch.zeros(
-                        (image.shape[0], image.shape[1], width), dtype=image.dtype
-                    )
-
-        return image, y
-
-
-class SplitImages(object):
-    """
-    Splits a sequence image file into 5 images
-    """
-
-    def __call__(self, sample: torch.tensor) -> (torch.tensor, torch.tensor):
-        """
-        Applies the transformation to the sequence of images.
-
-        :param np.ndarray sample: Sequence image
-        :return: Dict[str, np.ndarray]- Transformed sequence of images
-        """
-        image, y = sample
-        width: int = int(image.size(2) / 5)
-        image1 = image[:, :, 0:width]
-        image2 = image[:, :, width : width * 2]
-        image3 = image[:, :, width * 2 : width * 3]
-        image4 = image[:, :, width * 3 : width * 4]
-        image5 = image[:, :, width * 4 : width * 5]
-        return torch.stack([image1, image2, image3, image4, image5]), torch.tensor(y)
-
-
-class SequenceColorJitter(object):
-    """
-    Randomly change the brightness, contrast and saturation of a sequence of images
-    """
-
-    def __init__(self, brightness=0.5, contrast=0.1, saturation=0.1, hue=0.5):
-        """
-        INIT
-
-        :param float brightness: Probability of changing brightness (0<=brightness<=1)
-        :param float contrast: Probability of changing contrast (0<=contrast<=1)
-        :param float saturation: Probability of changing saturation (0<=saturation<=1)
-        :param float hue: Probability of changing hue (0<=hue<=1)
-        """
-        self.jitter = transforms.ColorJitter(
-            brightness=brightness, contrast=contrast, saturation=saturation, hue=hue
-        )
-
-    def __call__(self, sample: Dict[str, torch.tensor]) -> (torch.tensor, torch.tensor):
-        """
-        Applies the transformation to the sequence of images.
-
-        :param Dict[str, torch.tensor] sample: Sequence of images
-        :return: Dict[str, torch.tensor]- Transformed sequence of images
-        """
-        images, y = sample
-        images = self.jitter(images)
-        return images, y
-
-
-class Normalize(object):
-    """
-    Normalize a tensor image with mean and standard deviation.
-    """
-
-    transform = transforms.Normalize(
-        mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]
-    )
-
-    def __call__(self, sample: (torch.tensor, torch.tensor)) -> (torch.tensor, torch.tensor):
-        """
-        Applies the transformation to the sequence of images.
-
-        :param Dict[str, torch.tensor] sample: Sequence of images
-        :return: Dict[str, torch.tensor]- Transformed sequence of images
-        """
-        images, y = sample
-
-        return (
-            torch.stack(
-                [
-                    self.transform(images[0] / 255.0),
-                    self.transform(images[1] / 255.0),
-                    self.transform(images[2] / 255.0),
-                    self.transform(images[3] / 255.0),
-                    self.transform(images[4] / 255.0),
-                ]
-            ),
-            y,
-        )
-
-
-def collate_fn(batch):
-    """
-    Collate function for the dataloader.
-
-    :param batch: List of samples
-    :return: Dict[str, torch.tensor]- Transformed sequence of images
-    """
-
-    return_dict: Dict[str, torch.tensor] = {
-        "images": torch.cat([b[0] for b in batch], dim=0),
-        "attention_mask": torch.cat([b[1] for b in batch], dim=0),
-        "y": torch.stack([b[2] for b in batch]),
-    }
-    return_dict["attention_mask"].requires_grad = False
-    return_dict["y"].requires_grad = False
-    return return_dict
-
-
-def set_worker_sharing_strategy(worker_id: int) -> None:
-    torch.multiprocessing.set_sharing_strategy("file_system")
-
-
-class Tedd1104Dataset(Dataset):
-    """TEDD1104 dataset."""
-
-    def __init__(
-        self,
-        dataset_dir: str,
-        hide_map_prob: float,
-        token_mask_prob: float,
-        transformer_nheads: int = None,
-        dropout_images_prob: List[float] = None,
-        sequence_length: int = 5,
-        control_mode: str = "keyboard",
-        train: bool = False,
-    ):
-
-        """
-        INIT
-
-        :param str dataset_dir: The directory of the dataset.
-        :param bool hide_map_prob: Probability of hiding the minimap (0<=hide_map_prob<=1)
-        :param bool token_mask_prob: Probability of masking a token in the transformer model (0<=token_mask_prob<=1)
-        :param int transformer_nheads: Number of heads in the transformer model, None if LSTM is used
-        :param List[float] dropout_images_prob: Probability of dropping an image (0<=dropout_images_prob<=1)
-        :param int sequence_length: Length of the image sequence
-        :param str control_mode: Type of the user input: "keyboard" or "controller"
-        :param bool train: If True, the dataset is used for training.
-        """
-
-        self.dataset_dir = dataset_dir
-        self.hide_map_prob = hide_map_prob
-        self.dropout_images_prob = (
-            dropout_images_prob if dropout_images_prob else [0.0] * sequence_length
-        )
-        self.control_mode = control_mode.lower()
-        self.sequence_length = sequence_length
-        self.token_mask_prob = token_mask_prob
-        self.transformer_nheads = transformer_nheads
-        self.train = train
-
-        assert self.control_mode in [
-            "keyboard",
-            "controller",
-        ], f"{self.control_mode} control mode not supported. Supported dataset types: [keyboard, controller].  "
-
-        assert 0 <= self.hide_map_prob <= 1.0, (
-            f"hide_map_prob not in 0 <= hide_map_prob <= 1.0 range. "
-            f"hide_map_prob: {self.hide_map_prob}"
-        )
-
-        assert len(self.dropout_images_prob) == 5, (
-            f"dropout_images_prob must have 5 probabilities, one for each image in the sequence. "
-            f"dropout_images_prob len: {len(dropout_images_prob)}"
-        )
-
-        for dropout_image_prob in self.dropout_images_prob:
-            assert 0 <= dropout_image_prob < 1.0, (
-                f"All probabilities in dropout_image_prob must be in the range 0 <= dropout_image_prob < 1.0. "
-                f"dropout_images_prob: {self.dropout_images_prob}"
-            )
-
-        assert 0 <= self.token_mask_prob < 1.0, (
-            f"token_mask_prob not in 0 <= token_mask_prob < 1.0 range. "
-            f"token_mask_prob: {self.token_mask_prob}"
-        )
-
-        if train:
-            self.transform = transforms.Compose(
-                [
-                    RemoveMinimap(hide_map_prob=hide_map_prob),
-                    RemoveImage(dropout_images_prob=dropout_images_prob),
-                    SplitImages(),
-                    SequenceColorJitter(),
-                    Normalize(),
-                ]
-            )
-        else:
-            self.transform = transforms.Compose(
-                [
-                    # RemoveMinimap(hide_map_prob=hide_map_prob),
-                    # RemoveImage(dropout_images_prob=dropout_images_prob),
-                    SplitImages(),
-                    # SequenceColorJitter(),
-                    Normalize(),
-                ]
-            )
-
-        self.dataset_files = glob.glob(os.path.join(dataset_dir, "*.jpeg"))
-
-        self.IOHandler = IOHandler()
-
-    def __len__(self):
-        """
-        Returns the length of the dataset.
-
-        :return: int - Length of the dataset.
-        """
-        return len(self.dataset_files)
-
-    def __getitem__(self, idx):
-        """
-        Returns a sample from the dataset.
-
-        :param int idx: Index of the sample.
-        :return: Dict[str, torch.tensor]- Transformed sequence of images
-        """
-        if torch.is_tensor(idx):
-            idx = int(idx)
-
-        img_name = self.dataset_files[idx]
-        image = None
-        while image is None:
-            try:
-                image = torchvision.io.read_image(img_name)
-            except (ValueError, FileNotFoundError) as err:
-                error_message = str(err).split("\n")[-1]
-                print(
-                    f"Error reading image: {img_name} probably a corrupted file.\n"
-                    f"Exception: {error_message}\n"
-                    f"We will load a random image instead."
-                )
-                img_name = self.dataset_files[
-                    int(len(self.dataset_files) * torch.rand(1))
-                ]
-
-        y = self.IOHandler.imagename_input_conversion(
-            image_name=img_name,
-            output_type=self.control_mode,
-        )
-
-        image, y = self.transform((image, y))
-
-        mask = get_mask(
-            train=self.train,
-            nheads=self.transformer_nheads,
-            mask_prob=self.token_mask_prob,
-            sequence_length=self.sequence_length,
-        )
-
-        return image, mask, y
-
-
-class Tedd1104DataModule(pl.LightningDataModule):
-    """
-    Tedd1104DataModule is a PyTorch Lightning DataModule for the Tedd1104 dataset.
-    """
-
-    def __init__(
-        self,
-        batch_size: int,
-        train_dir: str = None,
-        val_dir: str = None,
-        test_dir: str = None,
-        token_mask_prob: float = 0.0,
-        transformer_nheads: int = None,
-        sequence_length: int = 5,
-        hide_map_prob: float = 0.0,
-        dropout_images_prob: List[float] = None,
-        control_mode: str = "keyboard",
-        num_workers: int = os.cpu_count(),
-    ):
-        """
-        Initializes the Tedd1104DataModule.
-
-        :param int batch_size: Batch size for the dataset.
-        :param str train_dir: Directory containing the training dataset.
-        :param str val_dir: Directory containing the validation dataset.
-        :param str test_dir: Directory containing the test dataset.
-        :param bool token_mask_prob: Probability of masking a token in the transformer model (0<=token_mask_prob<=1)
-        :param int transformer_nheads: Number of heads in the transformer model, None if LSTM is used
-        :param int sequence_length: Length of the image sequence
-        :param float hide_map_prob: Probability of hiding the minimap (0<=hide_map_prob<=1)
-        :param float dropout_images_prob: Probability of dropping an image (0<=dropout_images_prob<=1)
-        :param str control_mode: Record the input from the "keyboard" or "controller"
-        :param int num_workers: Number of workers to use to load the dataset.
-        """
-        super().__init__()
-        self.train_dir = train_dir
-        self.val_dir = val_dir
-        self.test_dir = test_dir
-        self.batch_size = batch_size
-        self.token_mask_prob = token_mask_prob
-        self.transformer_nheads = transformer_nheads
-        self.sequence_length = sequence_length
-        self.hide_map_prob = hide_map_prob
-        self.dropout_images_prob = (
-            dropout_images_prob if dropout_images_prob else [0.0, 0.0, 0.0, 0.0, 0.0]
-        )
-        self.control_mode = control_mode
-
-        if num_workers > 32:
-            print(
-                "WARNING: num_workers is greater than 32, this may cause memory issues, consider using a smaller value."
-                "Go ahead if you have a lot of RAM."
-            )
-
-        self.num_workers = num_workers
-
-    def setup(self, stage: Optional[str] = None) -> None:
-        """
-        Sets up the dataset.
-
-        :param str stage: Stage of the setup.
-        """
-        if stage in (None, "fit"):
-            self.train_dataset = Tedd1104Dataset(
-                dataset_dir=self.train_dir,
-                hide_map_prob=self.hide_map_prob,
-                dropout_images_prob=self.dropout_images_prob,
-                control_mode=self.control_mode,
-                train=True,
-                token_mask_prob=self.token_mask_prob,
-                transformer_nheads=self.transformer_nheads,
-                sequence_length=self.sequence_length,
-            )
-
-            print(f"Total training samples: {len(self.train_dataset)}.")
-
-            self.val_dataset = Tedd1104Dataset(
-                dataset_dir=self.val_dir,
-                hide_map_prob=0.0,
-                dropout_images_prob=[0.0, 0.0, 0.0, 0.0, 0.0],
-                control_mode="keyboard",
-                token_mask_prob=0.0,
-                transformer_nheads=self.transformer_nheads,
-                sequence_length=self.sequence_length,
-            )
-
-            print(f"Total validation samples: {len(self.val_dataset)}.")
-
-        if stage in (None, "test"):
-            self.test_dataset = Tedd1104Dataset(
-                dataset_dir=self.test_dir,
-                hide_map_prob=0.0,
-                dropout_images_prob=[0.0, 0.0, 0.0, 0.0, 0.0],
-                control_mode="keyboard",
-                token_mask_prob=0.0,
-                transformer_nheads=self.transformer_nheads,
-                sequence_length=self.sequence_length,
-            )
-
-            print(f"Total test samples: {len(self.test_dataset)}.")
-
-    def train_dataloader(self) -> DataLoader:
-        """
-        Returns the training dataloader.
-
-        :return: DataLoader - Training dataloader.
-        """
-        return DataLoader(
-            self.train_dataset,
-            batch_size=self.batch_size,
-            num_workers=self.num_workers,
-            pin_memory=True,
-            shuffle=True,
-            persistent_workers=True,
-            collate_fn=collate_fn,
-            worker_init_fn=set_worker_sharing_strategy,
-        )
-
-    def val_dataloader(self) -> DataLoader:
-        """
-        Returns the validation dataloader.
-
-        :return: DataLoader - Validation dataloader.
-        """
-        return DataLoader(
-            self.val_dataset,
-            batch_size=self.batch_size,
-            num_workers=self.num_workers,
-            pin_memory=True,
-            shuffle=False,
-            persistent_workers=True,
-            collate_fn=collate_fn,
-            worker_init_fn=set_worker_sharing_strategy,
-        )
-
-    def test_dataloader(self) -> DataLoader:
-        """
-        Returns the test dataloader.
-
-        :return: DataLoader - Test dataloader.
-        """
-        return DataLoader(
-            self.test_dataset,
-            batch_size=self.batch_size,
-            num_workers=self.num_workers,
-            pin_memory=True,
-            shuffle=False,
-            persistent_workers=True,
-            collate_fn=collate_fn,
-            worker_init_fn=set_worker_sharing_strategy,
-        )
+from __future__ import print_function, division
+import os
+import json
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import torch
+import torchvision.io
+from torch.utils.data import Dataset
+from torchvision import transforms
+from typing import List, Optional, Dict, Union
+import numpy as np
+from utils import IOHandler, get_mask
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+except ImportError:
+    TurboJPEG = None
+
+try:
+    import webdataset as wds
+except ImportError:
+    wds = None
+
+_turbojpeg = threading.local()
+
+# How many upcoming images each dataset prefetches ahead of the current one
+_PREFETCH_DEPTH = 4
+
+# Per-channel statistics of the dataset images in [0, 1] range, with the
+# (x/255 - mean) / std normalization folded into x * NORM_SCALE + NORM_BIAS.
+# Shared by Normalize and the on-device normalization in Tedd1104ModelPL.
+IMAGE_MEAN = torch.tensor([0.485, 0.456, 0.406], dtype=torch.float32)
+IMAGE_STD = torch.tensor([0.229, 0.224, 0.225], dtype=torch.float32)
+NORM_SCALE = (1.0 / (255.0 * IMAGE_STD)).view(1, 3, 1, 1)
+NORM_BIAS = (-IMAGE_MEAN / IMAGE_STD).view(1, 3, 1, 1)
+
+
+# Tensor kernels of the per-sample transforms, scripted so the worker
+# processes skip the Python dispatch overhead and TorchScript can fuse the
+# elementwise ops.
+
+
+@torch.jit.script
+def _remove_minimap_jit(image: torch.Tensor, col_mask: torch.Tensor) -> torch.Tensor:
+    image[:, 215:].masked_fill_(col_mask, 0)
+    return image
+
+
+@torch.jit.script
+def _split_images_jit(image: torch.Tensor) -> torch.Tensor:
+    return (
+        image.reshape(3, image.size(1), 5, image.size(2) // 5)
+        .permute(2, 0, 1, 3)
+        .contiguous(memory_format=torch.channels_last)
+    )
+
+
+@torch.jit.script
+def _normalize_jit(
+    images: torch.Tensor, scale: torch.Tensor, bias: torch.Tensor
+) -> torch.Tensor:
+    return images.to(torch.float32).mul_(scale).add_(bias)
+
+
+def count_examples(dataset_dir: str) -> int:
+    return sum(1 for entry in os.scandir(dataset_dir) if entry.name.endswith(".jpeg"))
+
+
+def read_image(image_path: str) -> torch.Tensor:
+    """
+    Decodes a JPEG file into a (3, H, W) uint8 tensor. Uses libjpeg-turbo
+    (PyTurboJPEG) when it is installed, which decodes 2-4x faster than the
+    libjpeg build torchvision ships with; falls back to
+    torchvision.io.read_image otherwise.
+
+    :param str image_path: Path to the JPEG file.
+    :return: torch.Tensor - The decoded image.
+    """
+    if TurboJPEG is None:
+        return torchvision.io.read_image(image_path)
+    decoder = getattr(_turbojpeg, "decoder", None)
+    if decoder is None:
+        # One decoder instance per thread: the libjpeg-turbo handle keeps
+        # internal decompress state and is not safe for concurrent use, and
+        # the prefetcher calls read_image from multiple threads
+        decoder = _turbojpeg.decoder = TurboJPEG()
+    with open(image_path, "rb") as jpeg_file:
+        image = decoder.decode(jpeg_file.read(), pixel_format=TJPF_RGB)
+    return torch.from_numpy(image).permute(2, 0, 1)
+
+
+class RemoveMinimap(object):
+    """Remove minimap (black square) from all the images in the sequence"""
+
+    def __init__(self, hide_map_prob: float):
+        """
+        INIT
+
+        :param float hide_map_prob: Probability of hiding the minimap (0<=hide_map_prob<=1)
+        """
+
+        self.hide_map_prob = hide_map_prob
+        self.col_mask = None
+
+    def __call__(self, sample: Dict[str, torch.tensor]) -> (torch.tensor, torch.tensor):
+        """
+        Applies the transformation to the sequence of images.
+
+        :param Dict[str, np.ndarray] sample: Sequence of images
+        :return: Dict[str, np.ndarray]- Transformed sequence of images
+        """
+
+        image, y = sample
+
+        if self.hide_map_prob > 0:
+            if random.random() <= self.hide_map_prob:
+                if self.col_mask is None:
+                    # Boolean mask selecting the minimap columns of all 5
+                    # frames at once, built lazily once the width is known
+                    width: int = image.size(2) // 5
+                    self.col_mask = torch.zeros(image.size(2), dtype=torch.bool)
+                    for j in range(0, 5):
+                        self.col_mask[j * width : (j * width) + 80] = True
+                image = _remove_minimap_jit(image, self.col_mask)
+
+        return image, y
+
+
+class RemoveImage(object):
+    """
+    Removes random images (black out) from the sequence
+    """
+
+    def __init__(self, dropout_images_prob: List[float]):
+        """
+        INIT
+
+        :param  List[float] dropout_images_prob: Probability of dropping each image (0<=dropout_images_prob<=1)
+        """
+        self.dropout_images_prob = dropout_images_prob
+
+    def __call__(self, sample: Dict[str, torch.tensor]) -> (torch.tensor, torch.tensor):
+        """
+        Applies the transformation to the sequence of images.
+
+        :param Dict[str, np.ndarray] sample: Sequence of images
+        :return: Dict[str, np.ndarray]- Transformed sequence of images
+        """
+        image, y = sample
+
+        drop = [p > 0 and random.random() <= p for p in self.dropout_images_prob]
+
+        if any(drop):
+            width: int = image.size(2) // 5
+            image[:, :, torch.tensor(drop).repeat_interleave(width)] = 0
+
+        return image, y
+
+
+class SplitImages(object):
+    """
+    Splits a sequence image file into 5 images
+    """
+
+    def __call__(self, sample: torch.tensor) -> (torch.tensor, torch.tensor):
+        """
+        Applies the transformation to the sequence of images.
+
+        :param np.ndarray sample: Sequence image
+        :return: Dict[str, np.ndarray]- Transformed sequence of images
+        """
+        image, y = sample
+        # (3, H, 5*W) -> (5, 3, H, W) as a single reshape+transpose instead of
+        # materializing 5 slices and stacking them.
+        return _split_images_jit(image), torch.as_tensor(y)
+
+
+class SequenceColorJitter(object):
+    """
+    Randomly change the brightness, contrast, saturation and hue of a
+    sequence of images. Unlike transforms.ColorJitter, which chains a
+    separate pass over the tensor per property, brightness and contrast are
+    folded into a single in-place affine and saturation adds one blend pass.
+    Hue jitter needs a full HSV round trip per image, so it is only applied
+    with probability hue_prob.
+    """
+
+    def __init__(self, brightness=0.5, contrast=0.1, saturation=0.1, hue=0.5, hue_prob=0.1):
+        """
+        INIT
+
+        :param float brightness: How much to jitter brightness (factor drawn from [max(0,1-brightness), 1+brightness])
+        :param float contrast: How much to jitter contrast (factor drawn from [max(0,1-contrast), 1+contrast])
+        :param float saturation: How much to jitter saturation (factor drawn from [max(0,1-saturation), 1+saturation])
+        :param float hue: How much to jitter hue (factor drawn from [-hue, hue], 0<=hue<=0.5)
+        :param float hue_prob: Probability of applying the hue jitter (0<=hue_prob<=1)
+        """
+        self.jitter_ranges = torch.tensor(
+            [brightness, contrast, saturation], dtype=torch.float32
+        )
+        self.hue = hue
+        self.hue_prob = hue_prob
+        self.luma_weights = torch.tensor([0.299, 0.587, 0.114]).view(3, 1, 1)
+
+    def __call__(self, sample: Dict[str, torch.tensor]) -> (torch.tensor, torch.tensor):
+        """
+        Applies the transformation to the sequence of images.
+
+        :param Dict[str, torch.tensor] sample: Sequence of images
+        :return: Dict[str, torch.tensor]- Transformed sequence of images
+        """
+        images, y = sample
+
+        if self.hue > 0 and random.random() <= self.hue_prob:
+            images = transforms.functional.adjust_hue(
+                images, random.uniform(-self.hue, self.hue)
+            )
+
+        # One RNG call for all three jitter factors
+        factors = 1.0 + torch.empty(3).uniform_(-1.0, 1.0) * self.jitter_ranges
+        brightness, contrast, saturation = factors.clamp_(min=0.0).tolist()
+
+        images = images.to(torch.float32)
+
+        if saturation != 1.0:
+            gray = (images * self.luma_weights).sum(dim=-3, keepdim=True)
+            images.mul_(saturation).add_(gray, alpha=1.0 - saturation)
+
+        # ((x - mean) * contrast + mean) * brightness fused into one
+        # multiply-add pass
+        mean = images.mean(dim=(-3, -2, -1), keepdim=True)
+        images.mul_(contrast * brightness).add_(mean, alpha=(1.0 - contrast) * brightness)
+
+        return images.round_().clamp_(0, 255).to(torch.uint8), y
+
+
+class Normalize(object):
+    """
+    Normalize a tensor image with mean and standard deviation.
+    """
+
+    def __init__(
+        self,
+        mean: Optional[List[float]] = None,
+        std: Optional[List[float]] = None,
+    ):
+        """
+        INIT
+
+        :param List[float] mean: Per-channel mean of the dataset in [0, 1] range, IMAGE_MEAN if None
+        :param List[float] std: Per-channel standard deviation of the dataset in [0, 1] range, IMAGE_STD if None
+        """
+        if mean is None and std is None:
+            self.scale = NORM_SCALE
+            self.bias = NORM_BIAS
+        else:
+            mean = torch.as_tensor(
+                mean if mean is not None else IMAGE_MEAN, dtype=torch.float32
+            )
+            std = torch.as_tensor(
+                std if std is not None else IMAGE_STD, dtype=torch.float32
+            )
+            self.scale = (1.0 / (255.0 * std)).view(1, 3, 1, 1)
+            self.bias = (-mean / std).view(1, 3, 1, 1)
+
+    def __call__(self, sample: (torch.tensor, torch.tensor)) -> (torch.tensor, torch.tensor):
+        """
+        Applies the transformation to the sequence of images.
+
+        :param Dict[str, torch.tensor] sample: Sequence of images
+        :return: Dict[str, torch.tensor]- Transformed sequence of images
+        """
+        images, y = sample
+
+        return _normalize_jit(images, self.scale, self.bias), y
+
+
+def collate_fn(batch):
+    """
+    Collate function for the dataloader.
+
+    :param batch: List of samples
+    :return: Dict[str, torch.tensor]- Transformed sequence of images
+    """
+
+    return_dict: Dict[str, torch.tensor] = {
+        "images": torch.cat([b[0] for b in batch], dim=0),
+        "attention_mask": torch.cat([b[1] for b in batch], dim=0),
+        "y": torch.stack([b[2] for b in batch]),
+    }
+    return return_dict
+
+
+def set_worker_sharing_strategy(worker_id: int) -> None:
+    torch.multiprocessing.set_sharing_strategy("file_system")
+    # Derive the Python RNG state from the per-worker torch seed so the
+    # random.random() gates in the transforms stay reproducible per worker
+    random.seed(torch.initial_seed() % 2 ** 32)
+
+
+class Tedd1104Dataset(Dataset):
+    """TEDD1104 dataset."""
+
+    def __init__(
+        self,
+        dataset_dir: str,
+        hide_map_prob: float,
+        token_mask_prob: float,
+        transformer_nheads: int = None,
+        dropout_images_prob: List[float] = None,
+        sequence_length: int = 5,
+        control_mode: str = "keyboard",
+        train: bool = False,
+    ):
+
+        """
+        INIT
+
+        :param str dataset_dir: The directory of the dataset.
+        :param bool hide_map_prob: Probability of hiding the minimap (0<=hide_map_prob<=1)
+        :param bool token_mask_prob: Probability of masking a token in the transformer model (0<=token_mask_prob<=1)
+        :param int transformer_nheads: Number of heads in the transformer model, None if LSTM is used
+        :param List[float] dropout_images_prob: Probability of dropping an image (0<=dropout_images_prob<=1)
+        :param int sequence_length: Length of the image sequence
+        :param str control_mode: Type of the user input: "keyboard" or "controller"
+        :param bool train: If True, the dataset is used for training.
+        """
+
+        self.dataset_dir = dataset_dir
+        self.hide_map_prob = hide_map_prob
+        self.dropout_images_prob = (
+            dropout_images_prob if dropout_images_prob else [0.0] * sequence_length
+        )
+        self.control_mode = control_mode.lower()
+        self.sequence_length = sequence_length
+        self.token_mask_prob = token_mask_prob
+        self.transformer_nheads = transformer_nheads
+        self.train = train
+
+        assert self.control_mode in [
+            "keyboard",
+            "controller",
+        ], f"{self.control_mode} control mode not supported. Supported dataset types: [keyboard, controller].  "
+
+        assert 0 <= self.hide_map_prob <= 1.0, (
+            f"hide_map_prob not in 0 <= hide_map_prob <= 1.0 range. "
+            f"hide_map_prob: {self.hide_map_prob}"
+        )
+
+        assert len(self.dropout_images_prob) == 5, (
+            f"dropout_images_prob must have 5 probabilities, one for each image in the sequence. "
+            f"dropout_images_prob len: {len(dropout_images_prob)}"
+        )
+
+        for dropout_image_prob in self.dropout_images_prob:
+            assert 0 <= dropout_image_prob < 1.0, (
+                f"All probabilities in dropout_image_prob must be in the range 0 <= dropout_image_prob < 1.0. "
+                f"dropout_images_prob: {self.dropout_images_prob}"
+            )
+
+        assert 0 <= self.token_mask_prob < 1.0, (
+            f"token_mask_prob not in 0 <= token_mask_prob < 1.0 range. "
+            f"token_mask_prob: {self.token_mask_prob}"
+        )
+
+        # Images are kept as uint8 here; normalization happens on-device in
+        # Tedd1104ModelPL.on_after_batch_transfer so the host->device copy
+        # moves 4x fewer bytes.
+        if train:
+            self.transform = transforms.Compose(
+                [
+                    RemoveMinimap(hide_map_prob=hide_map_prob),
+                    RemoveImage(dropout_images_prob=dropout_images_prob),
+                    SplitImages(),
+                    SequenceColorJitter(),
+                ]
+            )
+        else:
+            self.transform = transforms.Compose(
+                [
+                    # RemoveMinimap(hide_map_prob=hide_map_prob),
+                    # RemoveImage(dropout_images_prob=dropout_images_prob),
+                    SplitImages(),
+                    # SequenceColorJitter(),
+                ]
+            )
+
+        dataset_files = [
+            entry.path
+            for entry in os.scandir(dataset_dir)
+            if entry.name.endswith(".jpeg")
+        ]
+
+        # Store the file list as a single bytes blob plus an offsets array
+        # instead of a Python list of str: one object shared copy-on-write
+        # with forked workers instead of millions of pickled strings.
+        self.dataset_files_blob = "\0".join(dataset_files).encode("utf-8")
+        self.dataset_files_offsets = np.cumsum(
+            [0] + [len(path.encode("utf-8")) + 1 for path in dataset_files],
+            dtype=np.int64,
+        )
+
+        self.IOHandler = IOHandler()
+
+        # get_mask is deterministic unless we are training with token masking,
+        # so compute it once instead of once per sample. Consumers never
+        # mutate the mask, so sharing one tensor across samples is safe.
+        if not self.train or self.token_mask_prob == 0:
+            self.cached_mask = get_mask(
+                train=False,
+                nheads=self.transformer_nheads,
+                mask_prob=0.0,
+                sequence_length=self.sequence_length,
+            )
+        else:
+            self.cached_mask = None
+
+        # Lazily created per process, see _read_prefetched
+        self._prefetch_pool = None
+        self._prefetch_futures = {}
+        self._prefetch_last_idx = -2
+
+    def __getstate__(self):
+        # Thread pools and futures cannot be pickled; every dataloader worker
+        # lazily creates its own in _read_prefetched
+        state = self.__dict__.copy()
+        state["_prefetch_pool"] = None
+        state["_prefetch_futures"] = {}
+        state["_prefetch_last_idx"] = -2
+        return state
+
+    def _read_prefetched(self, idx: int) -> torch.Tensor:
+        """
+        Reads the image at idx and, only while the access pattern is actually
+        sequential, issues decodes for the next few indices on a small thread
+        pool so JPEG decode overlaps with the Python transform work of the
+        current sample (the decoders release the GIL). This helps the
+        shuffle=False val/test loaders; under shuffled access every index is
+        a jump, so nothing is ever submitted and the pool stays idle instead
+        of wasting decodes on guesses. Pending futures are cancelled on the
+        first non-sequential access, which keeps the work queue bounded by
+        _PREFETCH_DEPTH.
+
+        :param int idx: Index of the sample.
+        :return: torch.Tensor - The decoded image.
+        """
+        future = self._prefetch_futures.pop(idx, None)
+
+        sequential = idx == self._prefetch_last_idx + 1
+        self._prefetch_last_idx = idx
+
+        if sequential:
+            if self._prefetch_pool is None:
+                self._prefetch_pool = ThreadPoolExecutor(max_workers=2)
+            for next_idx in range(idx + 1, min(idx + 1 + _PREFETCH_DEPTH, len(self))):
+                if next_idx not in self._prefetch_futures:
+                    self._prefetch_futures[next_idx] = self._prefetch_pool.submit(
+                        read_image, self._get_file(next_idx)
+                    )
+        elif self._prefetch_futures:
+            # The pattern broke, the queued decodes will not be consumed
+            for stale_future in self._prefetch_futures.values():
+                stale_future.cancel()
+            self._prefetch_futures.clear()
+
+        if future is None:
+            return read_image(self._get_file(idx))
+
+        return future.result()
+
+    def _get_file(self, idx: int) -> str:
+        """
+        Decodes the path of a dataset file from the packed file list.
+
+        :param int idx: Index of the file.
+        :return: str - Path of the file.
+        """
+        return self.dataset_files_blob[
+            self.dataset_files_offsets[idx] : self.dataset_files_offsets[idx + 1] - 1
+        ].decode("utf-8")
+
+    def __len__(self):
+        """
+        Returns the length of the dataset.
+
+        :return: int - Length of the dataset.
+        """
+        return len(self.dataset_files_offsets) - 1
+
+    def __getitem__(self, idx):
+        """
+        Returns a sample from the dataset.
+
+        :param int idx: Index of the sample.
+        :return: Dict[str, torch.tensor]- Transformed sequence of images
+        """
+        if torch.is_tensor(idx):
+            idx = int(idx)
+
+        img_name = self._get_file(idx)
+        image = None
+        while image is None:
+            try:
+                image = self._read_prefetched(idx)
+            except (ValueError, FileNotFoundError, OSError, RuntimeError) as err:
+                error_message = str(err).split("\n")[-1]
+                print(
+                    f"Error reading image: {img_name} probably a corrupted file.\n"
+                    f"Exception: {error_message}\n"
+                    f"We will load a random image instead."
+                )
+                idx = random.randrange(len(self))
+                img_name = self._get_file(idx)
+
+        y = self.IOHandler.imagename_input_conversion(
+            image_name=img_name,
+            output_type=self.control_mode,
+        )
+
+        image, y = self.transform((image, y))
+
+        if self.cached_mask is not None:
+            mask = self.cached_mask
+        else:
+            mask = get_mask(
+                train=self.train,
+                nheads=self.transformer_nheads,
+                mask_prob=self.token_mask_prob,
+                sequence_length=self.sequence_length,
+            )
+
+        return image, mask, y
+
+
+class MemmappedTedd1104Dataset(Dataset):
+    """
+    TEDD1104 dataset served from a decoded uint8 memmap cache built with
+    scripts/cache_dataset_memmap.py. __getitem__ is a memcpy out of the
+    memmap plus augmentation: the per-file filesystem reads and the JPEG
+    decode are paid once when the cache is created instead of every epoch.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        hide_map_prob: float,
+        token_mask_prob: float,
+        transformer_nheads: int = None,
+        dropout_images_prob: List[float] = None,
+        sequence_length: int = 5,
+        control_mode: str = "keyboard",
+        train: bool = False,
+    ):
+
+        """
+        INIT
+
+        :param str cache_dir: Directory containing the memmap cache (images.bin, labels.npy, metadata.json).
+        :param bool hide_map_prob: Probability of hiding the minimap (0<=hide_map_prob<=1)
+        :param bool token_mask_prob: Probability of masking a token in the transformer model (0<=token_mask_prob<=1)
+        :param int transformer_nheads: Number of heads in the transformer model, None if LSTM is used
+        :param List[float] dropout_images_prob: Probability of dropping an image (0<=dropout_images_prob<=1)
+        :param int sequence_length: Length of the image sequence
+        :param str control_mode: Type of the user input: "keyboard" or "controller"
+        :param bool train: If True, the dataset is used for training.
+        """
+
+        self.cache_dir = cache_dir
+        self.hide_map_prob = hide_map_prob
+        self.dropout_images_prob = (
+            dropout_images_prob if dropout_images_prob else [0.0] * sequence_length
+        )
+        self.control_mode = control_mode.lower()
+        self.sequence_length = sequence_length
+        self.token_mask_prob = token_mask_prob
+        self.transformer_nheads = transformer_nheads
+        self.train = train
+
+        with open(
+            os.path.join(cache_dir, "metadata.json"), "r", encoding="utf8"
+        ) as metadata_file:
+            metadata = json.load(metadata_file)
+
+        assert metadata["control_mode"] == self.control_mode, (
+            f"The cache in {cache_dir} stores {metadata['control_mode']} labels, "
+            f"but {self.control_mode} labels were requested. Rebuild the cache "
+            f"with scripts/cache_dataset_memmap.py."
+        )
+
+        self.images_shape = (metadata["num_examples"],) + tuple(
+            metadata["image_shape"]
+        )
+        self.labels = np.load(os.path.join(cache_dir, "labels.npy"))
+
+        if train:
+            self.transform = transforms.Compose(
+                [
+                    RemoveMinimap(hide_map_prob=hide_map_prob),
+                    RemoveImage(dropout_images_prob=self.dropout_images_prob),
+                    SplitImages(),
+                    SequenceColorJitter(),
+                ]
+            )
+        else:
+            self.transform = transforms.Compose(
+                [
+                    SplitImages(),
+                ]
+            )
+
+        if not self.train or self.token_mask_prob == 0:
+            self.cached_mask = get_mask(
+                train=False,
+                nheads=self.transformer_nheads,
+                mask_prob=0.0,
+                sequence_length=self.sequence_length,
+            )
+        else:
+            self.cached_mask = None
+
+        # Opened lazily in __getitem__: a pickled np.memmap materializes the
+        # whole array, so each dataloader worker maps the file itself
+        self.images = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["images"] = None
+        return state
+
+    def __len__(self):
+        """
+        Returns the length of the dataset.
+
+        :return: int - Length of the dataset.
+        """
+        return self.images_shape[0]
+
+    def __getitem__(self, idx):
+        """
+        Returns a sample from the dataset.
+
+        :param int idx: Index of the sample.
+        :return: Dict[str, torch.tensor]- Transformed sequence of images
+        """
+        if torch.is_tensor(idx):
+            idx = int(idx)
+
+        if self.images is None:
+            self.images = np.memmap(
+                os.path.join(self.cache_dir, "images.bin"),
+                dtype=np.uint8,
+                mode="r",
+                shape=self.images_shape,
+            )
+
+        # np.array copies, the in-place transforms must not write through to
+        # the cache
+        image = torch.from_numpy(np.array(self.images[idx]))
+        y = self.labels[idx]
+
+        image, y = self.transform((image, y))
+
+        if self.cached_mask is not None:
+            mask = self.cached_mask
+        else:
+            mask = get_mask(
+                train=self.train,
+                nheads=self.transformer_nheads,
+                mask_prob=self.token_mask_prob,
+                sequence_length=self.sequence_length,
+            )
+
+        return image, mask, y
+
+
+def tedd1104_webdataset(
+    shards: Union[str, List[str]],
+    hide_map_prob: float,
+    token_mask_prob: float,
+    transformer_nheads: int = None,
+    dropout_images_prob: List[float] = None,
+    sequence_length: int = 5,
+    control_mode: str = "keyboard",
+    train: bool = False,
+):
+    """
+    Sequential-read variant of Tedd1104Dataset backed by webdataset tar
+    shards (create them with scripts/create_webdataset_shards.py). Reading
+    large tars sequentially avoids the per-file open/stat latency of
+    random-access reads over millions of jpeg files. Samples are compatible
+    with collate_fn. Requires the optional webdataset package.
+
+    :param Union[str, List[str]] shards: Shard paths or a brace-expandable pattern.
+    :param bool hide_map_prob: Probability of hiding the minimap (0<=hide_map_prob<=1)
+    :param bool token_mask_prob: Probability of masking a token in the transformer model (0<=token_mask_prob<=1)
+    :param int transformer_nheads: Number of heads in the transformer model, None if LSTM is used
+    :param List[float] dropout_images_prob: Probability of dropping an image (0<=dropout_images_prob<=1)
+    :param int sequence_length: Length of the image sequence
+    :param str control_mode: Type of the user input: "keyboard" or "controller"
+    :param bool train: If True, the dataset is used for training.
+    """
+    if wds is None:
+        raise ImportError(
+            "webdataset is not installed, install it with 'pip install webdataset' "
+            "to use tedd1104_webdataset."
+        )
+
+    control_mode = control_mode.lower()
+    dropout_images_prob = (
+        dropout_images_prob if dropout_images_prob else [0.0] * sequence_length
+    )
+
+    if train:
+        transform = transforms.Compose(
+            [
+                RemoveMinimap(hide_map_prob=hide_map_prob),
+                RemoveImage(dropout_images_prob=dropout_images_prob),
+                SplitImages(),
+                SequenceColorJitter(),
+            ]
+        )
+    else:
+        transform = transforms.Compose(
+            [
+                SplitImages(),
+            ]
+        )
+
+    io_handler = IOHandler()
+
+    if not train or token_mask_prob == 0:
+        cached_mask = get_mask(
+            train=False,
+            nheads=transformer_nheads,
+            mask_prob=0.0,
+            sequence_length=sequence_length,
+        )
+    else:
+        cached_mask = None
+
+    def to_example(sample):
+        # The shards store each image under a dot-free index key with the
+        # original filename in a companion .txt member (controller filenames
+        # contain dots that would otherwise end up in the webdataset
+        # extension), see scripts/create_webdataset_shards.py
+        image = sample["jpeg"]
+        y = io_handler.imagename_input_conversion(
+            image_name=sample["txt"],
+            output_type=control_mode,
+        )
+        image, y = transform((image, y))
+
+        if cached_mask is not None:
+            mask = cached_mask
+        else:
+            mask = get_mask(
+                train=train,
+                nheads=transformer_nheads,
+                mask_prob=token_mask_prob,
+                sequence_length=sequence_length,
+            )
+
+        return image, mask, y
+
+    dataset = wds.WebDataset(shards, shardshuffle=train)
+    if train:
+        dataset = dataset.shuffle(1000)
+    return dataset.decode("torchrgb8").map(to_example)
+
+
+def __getattr__(name):
+    # Keep `from dataset import Tedd1104DataModule` working without importing
+    # pytorch_lightning at module load: dataloader workers re-importing this
+    # module only need the dataset and should not pay the lightning startup
+    # cost (PEP 562 lazy re-export).
+    if name == "Tedd1104DataModule":
+        from datamodule import Tedd1104DataModule
+
+        return Tedd1104DataModule
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
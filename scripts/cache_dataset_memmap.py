@@ -0,0 +1,148 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+from tqdm.auto import tqdm
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataset import read_image
+from utils import IOHandler
+
+
+def cache_dataset_memmap(
+    dataset_dir: str,
+    output_dir: str,
+    control_mode: str = "keyboard",
+):
+    """
+    Decode every jpeg of a dataset directory once and store the raw uint8
+    sequence strips in a single on-disk memmap, with the labels in a separate
+    numpy file (see MemmappedTedd1104Dataset in dataset.py). Training epochs
+    over the cache skip both the per-file filesystem latency and the JPEG
+    decode.
+
+    :param str dataset_dir: Path to the dataset directory.
+    :param str output_dir: Path to the output directory.
+    :param str control_mode: Label format to store: "keyboard" or "controller".
+    """
+
+    dataset_files = [
+        entry.path
+        for entry in os.scandir(dataset_dir)
+        if entry.name.endswith(".jpeg")
+    ]
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    io_handler = IOHandler()
+
+    print(f"Caching {len(dataset_files)} images into a uint8 memmap.")
+    print(f"Dataset directory: {dataset_dir}")
+    print(f"Output directory: {output_dir}")
+    print("This may take a while, go grab a coffee!")
+    print()
+
+    images_path = os.path.join(output_dir, "images.bin")
+
+    # The memmap is created on the first successful decode (we need the image
+    # shape) and corrupted files are skipped, so one truncated jpeg does not
+    # abort a multi-hour caching run.
+    images = None
+    image_shape = None
+    labels = []
+    num_cached = 0
+    for dataset_file in tqdm(dataset_files, desc="Caching images"):
+        try:
+            image = read_image(dataset_file).numpy()
+        except (ValueError, FileNotFoundError, OSError, RuntimeError) as err:
+            error_message = str(err).split("\n")[-1]
+            print(
+                f"Error reading image: {dataset_file} probably a corrupted file.\n"
+                f"Exception: {error_message}\n"
+                f"The file will be skipped."
+            )
+            continue
+
+        if images is None:
+            image_shape = image.shape
+            images = np.memmap(
+                images_path,
+                dtype=np.uint8,
+                mode="w+",
+                shape=(len(dataset_files),) + image_shape,
+            )
+
+        images[num_cached] = image
+        labels.append(
+            io_handler.imagename_input_conversion(
+                image_name=dataset_file,
+                output_type=control_mode,
+            )
+        )
+        num_cached += 1
+
+    if images is None:
+        raise RuntimeError(
+            f"No image of {dataset_dir} could be decoded, no cache was written."
+        )
+
+    images.flush()
+    del images
+
+    if num_cached < len(dataset_files):
+        print(f"Skipped {len(dataset_files) - num_cached} corrupted files.")
+        os.truncate(images_path, num_cached * int(np.prod(image_shape)))
+
+    np.save(os.path.join(output_dir, "labels.npy"), np.asarray(labels))
+
+    with open(
+        os.path.join(output_dir, "metadata.json"), "w", encoding="utf8"
+    ) as metadata_file:
+        json.dump(
+            {
+                "num_examples": num_cached,
+                "image_shape": list(image_shape),
+                "control_mode": control_mode,
+            },
+            metadata_file,
+        )
+
+    print(f"Done. {num_cached} images cached to {output_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Cache the decoded dataset into an on-disk uint8 memmap."
+    )
+
+    parser.add_argument(
+        "--dataset_dir",
+        type=str,
+        required=True,
+        help="Path to the dataset dir",
+    )
+
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        required=True,
+        help="Path to the output dir",
+    )
+
+    parser.add_argument(
+        "--control_mode",
+        type=str,
+        default="keyboard",
+        choices=["keyboard", "controller"],
+        help="Label format to store",
+    )
+
+    args = parser.parse_args()
+
+    cache_dataset_memmap(
+        dataset_dir=args.dataset_dir,
+        output_dir=args.output_dir,
+        control_mode=args.control_mode,
+    )
@@ -0,0 +1,100 @@
+import glob
+import io
+import os
+import tarfile
+import argparse
+from tqdm.auto import tqdm
+
+
+def create_webdataset_shards(
+    dataset_dir: str,
+    output_dir: str,
+    shard_size_gb: float = 1.0,
+):
+    """
+    Pack the dataset jpeg files into tar shards for sequential reading with
+    webdataset (see tedd1104_webdataset in dataset.py). webdataset splits tar
+    member names at the first dot, and controller recordings embed float
+    label values with dots in the filename, so each image is stored under a
+    dot-free index name with the original filename in a companion .txt
+    member that the pipeline uses to recover the labels.
+
+    :param str dataset_dir: Path to the dataset directory.
+    :param str output_dir: Path to the output directory.
+    :param float shard_size_gb: Approximate size of each shard in GB.
+    """
+
+    dataset_files = glob.glob(os.path.join(dataset_dir, "*.jpeg"))
+    shard_size_bytes = int(shard_size_gb * 1024 ** 3)
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    print(f"Packing {len(dataset_files)} images into ~{shard_size_gb}GB shards.")
+    print(f"Dataset directory: {dataset_dir}")
+    print(f"Output directory: {output_dir}")
+    print()
+
+    shard_no = 0
+    shard_bytes = 0
+    shard = tarfile.open(
+        os.path.join(output_dir, f"shard-{shard_no:06d}.tar"), mode="w"
+    )
+
+    for example_no, dataset_file in enumerate(
+        tqdm(dataset_files, desc="Packing images")
+    ):
+        if shard_bytes >= shard_size_bytes:
+            shard.close()
+            shard_no += 1
+            shard_bytes = 0
+            shard = tarfile.open(
+                os.path.join(output_dir, f"shard-{shard_no:06d}.tar"), mode="w"
+            )
+
+        shard.add(dataset_file, arcname=f"{example_no:09d}.jpeg")
+
+        image_name = os.path.basename(dataset_file).encode("utf-8")
+        name_info = tarfile.TarInfo(name=f"{example_no:09d}.txt")
+        name_info.size = len(image_name)
+        shard.addfile(name_info, io.BytesIO(image_name))
+
+        shard_bytes += os.path.getsize(dataset_file) + len(image_name)
+
+    shard.close()
+
+    print(f"Done. {shard_no + 1} shards written to {output_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Pack the dataset into webdataset tar shards."
+    )
+
+    parser.add_argument(
+        "--dataset_dir",
+        type=str,
+        required=True,
+        help="Path to the dataset dir",
+    )
+
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        required=True,
+        help="Path to the output dir",
+    )
+
+    parser.add_argument(
+        "--shard_size_gb",
+        type=float,
+        default=1.0,
+        help="Approximate size of each shard in GB",
+    )
+
+    args = parser.parse_args()
+
+    create_webdataset_shards(
+        dataset_dir=args.dataset_dir,
+        output_dir=args.output_dir,
+        shard_size_gb=args.shard_size_gb,
+    )
@@ -1,7 +1,7 @@
 from model import Tedd1104ModelPL
 from typing import List
 import argparse
-from dataset import Tedd1104DataModule
+from datamodule import Tedd1104DataModule
 import os
 from pytorch_lightning import loggers as pl_loggers
 import pytorch_lightning as pl